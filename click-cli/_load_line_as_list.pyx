@@ -0,0 +1,33 @@
+# cython: language_level=3
+"""
+Optional Cython version of mycli.py's load_line_as_list(), used by
+'mycli.py csvstats --all-rows' once it has been built. It needs Cython and a
+C compiler (pip install cython), build it in place from this directory with:
+
+    cythonize -i _load_line_as_list.pyx
+
+mycli.py falls back to the pure python version when it hasn't been built.
+"""
+# Cython - https://cython.readthedocs.io/en/latest/
+
+
+cpdef list load_line_as_list(str line):
+    """
+    split the line on commas and return a List of values, with any missing
+    value (an empty cell) replaced by 'nosuppliedvalue'.
+    """
+    cdef bytes encoded = line.encode('utf-8')
+    cdef const char *buf = encoded
+    cdef Py_ssize_t length = len(encoded)
+    cdef Py_ssize_t i
+    cdef Py_ssize_t value_start = 0
+    cdef list values_list = []
+
+    # A typed C loop over the UTF-8 bytes, a comma byte never appears inside a multi-byte character
+    for i in range(length):
+        if buf[i] == b',':
+            values_list.append(buf[value_start:i].decode('utf-8') if i > value_start else 'nosuppliedvalue')
+            value_start = i + 1
+    values_list.append(buf[value_start:length].decode('utf-8') if length > value_start else 'nosuppliedvalue')
+
+    return values_list
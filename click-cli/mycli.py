@@ -2,70 +2,206 @@
 """
 A sample CLI tool using python's logging and external libraries Click, Rich, rich-click, and tqdm
 """
+import itertools
 import logging
+import mmap
+import os
 import pathlib
-import re
 import sys
 import time
 import traceback
+import warnings
 # rich_click - Format click help output nicely with Rich.
 # https://github.com/ewels/rich-click
 import rich_click as click
 # Rich - writing rich text to the terminal
 # https://rich.readthedocs.io/en/stable/index.html
-#   Rich Pretty Printing
-# https://rich.readthedocs.io/en/stable/pretty.html
-from rich.pretty import pprint
-# tqdm - https://tqdm.github.io/
-from tqdm import tqdm
+# Rich and tqdm are imported inside the functions that use them, so that
+# '--help' and runs that never reach them don't pay for the import
 
 # https://docs.python.org/3/library/logging.html
 logger = logging.getLogger(__name__)
+# https://docs.python.org/3/library/logging.html#logrecord-attributes
+# https://docs.python.org/3/library/datetime.html#strftime-and-strptime-format-codes
+RICH_LOG_FORMAT = "%(name)s %(message)s"
+RICH_LOG_DATEFMT = "%Y-%m-%d-%H-%M-%S-%f-%z]"
+PLAIN_LOG_FORMAT = "%(asctime)s %(name)s %(levelname)-8s %(message)s"
+# set once main() has configured logging for this process
+_LOGGING_CONFIGURED = False
 
 
-def read_line_from_file(inputfile, current_line_num):
+def mmap_file(inputfile):
     """
-    Takes a desired line number and returns the String line content and that line number
+    Opens inputfile once and maps it read-only into memory, so that it can be scanned
+    several times (line count, line lookups) without re-opening and re-reading it
+    """
+    # https://docs.python.org/3/library/mmap.html
+    # The mapping stays valid after the file object itself is closed
+    with open(inputfile, 'rb') as afile:
+        return mmap.mmap(afile.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def iter_csv_lines(inputfile):
+    """
+    Yields the line number and String line content of every line in inputfile,
+    reading the file only once from start to end through a single file handle
+    """
+    with open(inputfile, 'r', encoding="utf-8") as infile:
+        for line_num, line in enumerate(infile):
+            yield line_num, line.rstrip('\n')
+
+
+def build_line_index(mapped_file):
+    """
+    Takes a memory mapped file and returns a List of the byte offset where each line starts,
+    built in a single pass. Line K is then mapped_file[index[K]:index[K + 1]] (up to the end
+    of the file for the last line), without scanning the lines before it again.
+    """
+    line_index = [0] if len(mapped_file) else []
+    newline = mapped_file.find(b'\n')
+    while newline != -1 and newline + 1 < len(mapped_file):
+        line_index.append(newline + 1)
+        newline = mapped_file.find(b'\n', newline + 1)
+    return line_index
+
+
+def read_line_from_file(mapped_file, current_line_num, line_index=None):
+    """
+    Takes a memory mapped file and a desired line number and returns the String line content and that line number
+
+    line_index is the List of line start offsets from build_line_index(). Build it once and pass
+    it in when reading several lines, each line is then a single slice of the mapped file.
+    Deprecated without line_index: every call walks the file from the start again, which is
+    O(N^2) over the whole file. Use iter_csv_lines() to walk the lines instead.
     """
     # Assumes CSV file has first line as header so always +1 to the current_line_num
     # current_line_num = current_line_num + 1
+    if current_line_num < 0:
+        raise IndexError(f"line {current_line_num} is before the start of the file")
+    if line_index is None:
+        # https://docs.python.org/3/library/warnings.html#warnings.warn
+        warnings.warn("read_line_from_file() without line_index is deprecated, use iter_csv_lines() or build_line_index()", DeprecationWarning, stacklevel=2)
+        # Jump from newline to newline with mmap.find() and stop at the wanted line,
+        # none of the lines before it are turned into python objects
+        line_start = 0
+        for _ in range(current_line_num):
+            newline = mapped_file.find(b'\n', line_start)
+            if newline == -1:
+                raise IndexError(f"line {current_line_num} is past the end of the file")
+            line_start = newline + 1
+        if line_start >= len(mapped_file):
+            raise IndexError(f"line {current_line_num} is past the end of the file")
+        line_end = mapped_file.find(b'\n', line_start)
+        if line_end == -1:
+            line_end = len(mapped_file)
+    else:
+        if current_line_num >= len(line_index):
+            raise IndexError(f"line {current_line_num} is past the end of the file")
+        line_start = line_index[current_line_num]
+        line_end = line_index[current_line_num + 1] if current_line_num + 1 < len(line_index) else len(mapped_file)
+    line = mapped_file[line_start:line_end]
+    # strip the line ending, either '\n' or '\r\n'
+    if line.endswith(b'\n'):
+        line = line[:-1]
+    if line.endswith(b'\r'):
+        line = line[:-1]
+    return line.decode('utf-8'), current_line_num
+
+
+def file_len(mapped_file):
+    """
+    quick and dirty function to get get file length of a memory mapped file
+    """
+    # Count the newlines in 1MB slices with bytes.count(), this skips the UTF-8
+    # decoding and the per-line python loop
+    chunk_size = 1 << 20
+    num_lines = sum(mapped_file[offset:offset + chunk_size].count(b'\n') for offset in range(0, len(mapped_file), chunk_size))
+    # a last line without a trailing newline still counts as a line
+    if mapped_file[-1:] not in (b'', b'\n'):
+        num_lines += 1
+    return num_lines
+
+
+def _iter_rows(lines, line_splitter=None):
+    """
+    Takes an iterable of line numbers and String line contents and yields each
+    line number with the line loaded as a List of values by line_splitter,
+    load_line_as_list() by default
+    """
+    if line_splitter is None:
+        line_splitter = load_line_as_list
+    for line_num, line in lines:
+        logger.debug(line)
+        values = line_splitter(line)
+        yield line_num, values
+
+
+def _load_cython_splitter():
+    """
+    Returns the Cython-compiled load_line_as_list(), or None when _load_line_as_list.pyx
+    hasn't been built. Build it once with: cythonize -i _load_line_as_list.pyx
+    """
     try:
-        # A common pythonic way of opening files is the 'with some_item open()' but
-        # in this case, use the enumerate() to keep track of the line content and the line number
-        # This would be harder to do with 'with some_item open()'
-        infile = open(inputfile, 'r', encoding="utf-8")
-        for line_num, line in enumerate(infile):
-            if line_num == current_line_num:
-                line_at_line_num = line.rstrip('\n')
-        infile.close()
-        return line_at_line_num, current_line_num
-    except Exception:
-        logger.exception(f'Error: unable to read input logfile  {inputfile}')
-        sys.exit(2)
+        # https://cython.readthedocs.io/en/latest/src/userguide/source_files_and_compilation.html#compiling-from-the-command-line
+        from _load_line_as_list import load_line_as_list as cython_load_line_as_list
+    except ImportError:
+        logger.info("_load_line_as_list.pyx is not built, falling back to the pure python load_line_as_list")
+        return None
+    return cython_load_line_as_list
 
 
-def file_len(inputfile):
+def _load_pandas():
     """
-    quick and dirty function to get get file length
+    Returns the optional pandas module, or None when pandas is not installed
     """
     try:
-        with open(inputfile, 'r', encoding="utf-8") as afile:
-            for linenum, l in enumerate(afile):
-                pass
-        return linenum + 1
-    except Exception:
-        logger.exception(f'Error: unable to get file length of {inputfile}')
-        sys.exit(2)
+        # https://pandas.pydata.org/docs/reference/api/pandas.read_csv.html
+        import pandas
+    except ImportError:
+        logger.info("pandas is not installed")
+        return None
+    return pandas
+
+
+def _splitlines_rows(mapped_file, line_splitter=None):
+    """
+    Splits a memory mapped file into lines in C with one bytes.splitlines() and returns the
+    number of lines and an iterator of each line number with its List of values
+    """
+    # the list of lines gives the line count too, so file_len() isn't needed
+    lines = mapped_file[:].splitlines()
+    return len(lines), _iter_rows(((line_num, line.decode('utf-8')) for line_num, line in enumerate(lines)), line_splitter)
+
+
+def _pandas_rows(pandas, inputfile):
+    """
+    Parses inputfile with pandas.read_csv in one call and returns the number of lines and an
+    iterator of each line number with its List of values, like _splitlines_rows().
+    Unlike the line splitters, a row with more columns than the first row is an error, and a
+    shorter row (or a blank line) is padded with 'nosuppliedvalue' up to the number of columns.
+    """
+    # csv - https://docs.python.org/3/library/csv.html
+    import csv
+    try:
+        # header=None keeps the header as line 0 and QUOTE_NONE keeps quote characters as
+        # they are, like the other splitters. Empty cells are read as NaN and then filled
+        # with 'nosuppliedvalue'
+        csvfile_frame = pandas.read_csv(inputfile, header=None, dtype=str, na_values=[''], keep_default_na=False, skip_blank_lines=False, quoting=csv.QUOTE_NONE, on_bad_lines='error').fillna('nosuppliedvalue')
+    except pandas.errors.EmptyDataError:
+        # an empty file has no lines, the same as the line splitters
+        return 0, iter(())
+    except pandas.errors.ParserError as err:
+        raise click.ClickException(f"pandas can't parse {inputfile}: {str(err).strip()}. Rerun without --pandas to split it line by line.")
+    return len(csvfile_frame), enumerate(csvfile_frame.values.tolist())
 
 
 def load_line_as_list(line):
     """
-    do some regex substitution to account for possible missing values and
-    return a List of values.
+    split the line on commas and return a List of values, with any missing
+    value (an empty cell) replaced by 'nosuppliedvalue'.
     """
-    line_cleaned = re.sub(r'^,', 'nosuppliedvalue,', line)
-    line_cleaned = re.sub(r',,', ',nosuppliedvalue,', line_cleaned)
-    values_list = re.sub(",", " ", line_cleaned).split()
+    # A single str.split() pass instead of several regex substitutions
+    values_list = ['nosuppliedvalue' if value == '' else value for value in line.split(',')]
 
     return values_list
 
@@ -92,82 +228,148 @@ def main(ctx, loglevel, logstyle):
     By default, all logging to levels is set to CRITICAL.\n
     If any loglevel other than NOTSET is set, then by default the logging style is PLAIN. Rich-styled logging can be enabled by passing \"-s plain\".\n
     """
+    global _LOGGING_CONFIGURED
+    # upper-case the choices once instead of in every branch below
+    level = str(loglevel).upper()
+    style = str(logstyle).upper()
+    # Rich's styling and layout work is wasted when the output is piped to a file or
+    # another process, so fall back to plain logging and tracebacks in that case
+    if not sys.stdout.isatty():
+        style = "PLAIN"
     # ensure that ctx.obj exists and is a dict
     ctx.ensure_object(dict)
-    ctx.obj['logstyle'] = str(logstyle).upper()
+    ctx.obj['logstyle'] = style
     ctx.obj['console'] = "None"
     # Set logger level & logger style
     # https://docs.python.org/3/library/logging.html
-    if str(loglevel).upper() == "NOTSET":
+    if level == "NOTSET":
         # this disables logging.getLogger of all logging of 'CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG'
         logger.setLevel(logging.CRITICAL + 1)
+        return
 
-    # Turn on Rich Tracebacks and Rich Logging
-    if str(logstyle).upper() == "RICH" and str(loglevel).upper() != "NOTSET":
+    if style == "RICH":
         # https://rich.readthedocs.io/en/stable/console.html
         from rich.console import Console
         ctx.obj['console'] = Console()
 
+    # The logging handlers and the Rich traceback hook only need setting up once per process,
+    # e.g. when tests invoke main() in-process many times through click's CliRunner
+    if _LOGGING_CONFIGURED:
+        return
+    _LOGGING_CONFIGURED = True
+
+    # Turn on Rich Tracebacks and Rich Logging
+    if style == "RICH":
         # https://rich.readthedocs.io/en/stable/logging.html
         from rich.logging import RichHandler
         # https://docs.python.org/3/library/logging.html#logging.basicConfig
-        # https://docs.python.org/3/library/datetime.html#strftime-and-strptime-format-codes
-        FORMAT = "%(name)s %(message)s"
-        logging.basicConfig(level=str(loglevel).upper(), format=FORMAT, datefmt="%Y-%m-%d-%H-%M-%S-%f-%z]", handlers=[RichHandler()])
+        logging.basicConfig(level=level, format=RICH_LOG_FORMAT, datefmt=RICH_LOG_DATEFMT, handlers=[RichHandler()])
 
         # https://rich.readthedocs.io/en/stable/traceback.html
         from rich.traceback import install
         install(show_locals=True)
 
     # Use plain styled tracebacks and logging
-    if str(logstyle).upper() == "PLAIN" and str(loglevel).upper() != "NOTSET":
+    else:
         # https://docs.python.org/3/library/logging.html#logging.basicConfig
-        logging.basicConfig(level=str(loglevel).upper(), format='%(asctime)s %(name)s %(levelname)-8s %(message)s',)
+        logging.basicConfig(level=level, format=PLAIN_LOG_FORMAT)
 
 
 @main.command()
 # https://click.palletsprojects.com/en/8.1.x/arguments/#file-arguments
-@click.argument('csvfile', type=click.Path(exists=True))
+# path_type hands csvfile over as an already resolved pathlib.Path
+@click.argument('csvfile', type=click.Path(exists=True, path_type=pathlib.Path, resolve_path=True))
+# https://click.palletsprojects.com/en/8.1.x/options/#boolean-flags
+@click.option('--count/--no-count', default=False, help='Count the lines in csvfile. This reads the whole file, so it is off by default.')
+@click.option('--all-rows/--header-only', default=False, help='Walk every line in csvfile with a tqdm progress bar instead of only the header row.')
+@click.option('--pandas', 'use_pandas', is_flag=True, default=False, help='Only with --all-rows, parse csvfile with pandas.read_csv. A row with more columns than the first row is then an error, and shorter rows are padded with nosuppliedvalue.')
+@click.option('--demo/--no-demo', default=False, help='Sleep for 3 seconds so that different timestamps show up in the logs.')
 # https://click.palletsprojects.com/en/8.1.x/commands/#nested-handling-and-contexts
 # Commands can also ask for the context to be passed by marking themselves with the pass_context() decorator.
 # In that case, the context is passed as first argument.
 @click.pass_context
-def csvstats(ctx, csvfile):
-    """
-    Loads a csvfile as input, prints some stats, then iterates with a tqdm progress bar wrapper (only the first line in the file) and pretty prints the line using Rich.
-    """
-    logger.debug(f"csvfile is {csvfile}")
-    csvfile_path = pathlib.Path.cwd() / f"{csvfile}"
-    csvfile_len = file_len(csvfile_path)
-    print(f"csvfile {csvfile} length is {csvfile_len}")
-    current_line_num = 0
-    csvfile_len_datarows = csvfile_len - 1
-    print(f"Number of data rows in {csvfile_path}: {csvfile_len_datarows}")
-    print("a 3 second sleep so that we can see different timestamps in the logs")
-    time.sleep(3)
+def csvstats(ctx, csvfile, count, all_rows, use_pandas, demo):
+    """
+    Loads a csvfile as input, prints some stats (pass --count to also count the lines), then pretty prints the first line in the file using Rich. With --all-rows every line is walked with a tqdm progress bar wrapper.
+    """
+    logger.debug("csvfile is %s", csvfile)
+    # pandas is optional, so check for it before doing any work
+    if use_pandas:
+        if not all_rows:
+            raise click.UsageError("--pandas only applies with --all-rows")
+        pandas = _load_pandas()
+        if pandas is None:
+            raise click.UsageError("--pandas needs pandas installed: pip install pandas")
+    # os.path.getsize() is a single stat() call, counting the lines needs a full read of the file
+    csvfile_size = os.path.getsize(csvfile)
+    print(f"csvfile {csvfile} size is {csvfile_size} bytes")
+    # Only --count and --all-rows without --pandas scan the mapped file, the header row alone
+    # is read without mapping it. An empty file can't be mapped and has no lines, so it is
+    # never mapped. The helpers let their exceptions propagate, a file that can't be mapped
+    # is reported once here through click's own error handling
+    # https://click.palletsprojects.com/en/8.1.x/exceptions/
+    csvfile_mmap = None
+    if csvfile_size and (count or (all_rows and not use_pandas)):
+        try:
+            csvfile_mmap = mmap_file(csvfile)
+        except (OSError, ValueError) as err:
+            raise click.FileError(str(csvfile), hint=str(err))
+    if count:
+        csvfile_len = file_len(csvfile_mmap) if csvfile_mmap is not None else 0
+        print(f"csvfile {csvfile} length is {csvfile_len}")
+        # the header row isn't a data row, an empty file doesn't have one
+        csvfile_len_datarows = max(csvfile_len - 1, 0)
+        print(f"Number of data rows in {csvfile}: {csvfile_len_datarows}")
+    if demo:
+        print("a 3 second sleep so that we can see different timestamps in the logs")
+        time.sleep(3)
     # In this example first we wrap the whole thing in a 'try' so we can enable exception handling
-    # Next the 'for' loop contains a tqdm progress bar, which accepts the 'range()'
-    # function. range() arg 'stop' is hard set to 1, so we can just have it run against
-    # a single line: the header row. You could make it:
-    # "for current_line_num in tqdm(range(current_line_num, csvfile_len, 1)):"
-    # and it would walk the entire CSF file.
+    # Next the 'for' loop runs against a single line: the header row. With --all-rows
+    # it contains a tqdm progress bar and walks the entire CSV file, streaming the
+    # lines from one open file handle instead of re-reading the file for every line.
     # Lastly in the except block can turn on or off rich tracebacks
-    print(f"The first line in csvfile {csvfile_path} is:")
-    logger.info("In this example first we wrap the whole thing in a 'try' then 'for' loop which has a tqdm progress bar, which accepts the 'range()' function who's arg 'stop' is hard set to 1, so we can just have it run against a single line")
-    print("This use of the tqdm progress bar is just to show how it can be used")
+    print(f"The first line in csvfile {csvfile} is:")
+    logger.info("In this example first we wrap the whole thing in a 'try' then 'for' loop which runs against a single line, or against every line with a tqdm progress bar when --all-rows is passed")
+
+    # Rich Pretty Printing is only worth it on a terminal, plain print() is used when
+    # the output is piped to a file or another process
+    # https://rich.readthedocs.io/en/stable/pretty.html
+    if sys.stdout.isatty():
+        from rich.pretty import pprint
+    else:
+        pprint = print
 
     try:
-        # tqdm Objects https://tqdm.github.io/docs/tqdm/
-        for current_line_num in tqdm(range(current_line_num, 1, 1)):
-            line, current_line_num = read_line_from_file(csvfile_path, current_line_num)
-            logger.debug(line)
-            values = []
-            values = load_line_as_list(line)
-            logger.info("The pprint uses Rich to colorize the pprint")
+        if all_rows:
+            print("This use of the tqdm progress bar is just to show how it can be used")
+            # tqdm - https://tqdm.github.io/
+            from tqdm import tqdm
+            # With --pandas the whole file is parsed by its C parser in one call. Otherwise the
+            # mapped file is split into lines in C by one bytes.splitlines() and each line is
+            # split by load_line_as_list(), the Cython build of it when it has been compiled.
+            if use_pandas:
+                csvfile_len, rows = _pandas_rows(pandas, csvfile)
+            elif csvfile_mmap is None:
+                csvfile_len, rows = 0, iter(())
+            else:
+                csvfile_len, rows = _splitlines_rows(csvfile_mmap, _load_cython_splitter())
+            # tqdm Objects https://tqdm.github.io/docs/tqdm/
+            rows = tqdm(rows, total=csvfile_len)
+        else:
+            # A progress bar for a single line shows nothing, so the header row is read directly
+            rows = _iter_rows(itertools.islice(iter_csv_lines(csvfile), 1))
+        for current_line_num, values in rows:
+            logger.info("The pprint uses Rich to colorize the pprint when writing to a terminal")
             # https://rich.readthedocs.io/en/stable/pretty.html
             pprint(values)
-            logger.debug(f"current_line_num is {current_line_num}")
+            logger.debug("current_line_num is %s", current_line_num)
         some_func_with_warning()
+    except click.ClickException:
+        # click prints these itself and exits with a non-zero status
+        raise
+    except (UnicodeDecodeError, OSError) as err:
+        # A file that isn't UTF-8 or can't be read is bad input, not a bug to show a traceback for
+        raise click.FileError(str(csvfile), hint=str(err))
     except Exception:
         # https://click.palletsprojects.com/en/8.1.x/commands/#nested-handling-and-contexts
         if ctx.obj['logstyle'] == "RICH":
@@ -176,6 +378,9 @@ def csvstats(ctx, csvfile):
         else:
             # https://docs.python.org/3/library/traceback.html#traceback.format_exc
             print(traceback.format_exc())
+    finally:
+        if csvfile_mmap is not None:
+            csvfile_mmap.close()
 
 
 @main.command()
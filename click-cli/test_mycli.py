@@ -0,0 +1,162 @@
+"""
+Tests for mycli.py, run them from this directory with: python -m pytest
+"""
+# pytest - https://docs.pytest.org/en/stable/
+import pytest
+from click.testing import CliRunner
+
+import mycli
+
+# Every row has the same number of columns, with missing values, a quote character,
+# a CRLF line ending and no newline at the end of the file
+FIXTURE_CSV = b'rowid,name,fuel\r\n1,"Catawba",Nuclear\n2,,Gas\n,McGuire,\n4,Oconee,Hydro'
+FIXTURE_ROWS = [
+    (0, ['rowid', 'name', 'fuel']),
+    (1, ['1', '"Catawba"', 'Nuclear']),
+    (2, ['2', 'nosuppliedvalue', 'Gas']),
+    (3, ['nosuppliedvalue', 'McGuire', 'nosuppliedvalue']),
+    (4, ['4', 'Oconee', 'Hydro']),
+]
+
+
+def _python_rows(csvfile):
+    with mycli.mmap_file(csvfile) as mapped_file:
+        num_lines, rows = mycli._splitlines_rows(mapped_file)
+        return num_lines, list(rows)
+
+
+def _cython_rows(csvfile):
+    cython_splitter = mycli._load_cython_splitter()
+    if cython_splitter is None:
+        pytest.skip("_load_line_as_list.pyx is not built")
+    with mycli.mmap_file(csvfile) as mapped_file:
+        num_lines, rows = mycli._splitlines_rows(mapped_file, cython_splitter)
+        return num_lines, list(rows)
+
+
+def _pandas_rows(csvfile):
+    pandas = pytest.importorskip("pandas")
+    num_lines, rows = mycli._pandas_rows(pandas, csvfile)
+    return num_lines, list(rows)
+
+
+@pytest.fixture
+def csvfile(tmp_path):
+    path = tmp_path / "fixture.csv"
+    path.write_bytes(FIXTURE_CSV)
+    return path
+
+
+@pytest.mark.parametrize("load_rows", [_python_rows, _cython_rows, _pandas_rows])
+def test_all_rows_backends_agree(csvfile, load_rows):
+    num_lines, rows = load_rows(csvfile)
+    assert num_lines == len(FIXTURE_ROWS)
+    assert rows == FIXTURE_ROWS
+
+
+def test_python_rows_keep_every_field_of_a_ragged_row(tmp_path):
+    path = tmp_path / "ragged.csv"
+    path.write_bytes(b'a,b,c\n1,2,3,4\n')
+    assert _python_rows(path) == (2, [(0, ['a', 'b', 'c']), (1, ['1', '2', '3', '4'])])
+
+
+def test_pandas_rows_reject_a_ragged_row(tmp_path):
+    pandas = pytest.importorskip("pandas")
+    path = tmp_path / "ragged.csv"
+    path.write_bytes(b'a,b,c\n1,2,3,4\n')
+    with pytest.raises(mycli.click.ClickException):
+        mycli._pandas_rows(pandas, path)
+
+
+def test_pandas_rows_of_an_empty_file(tmp_path):
+    path = tmp_path / "empty.csv"
+    path.write_bytes(b'')
+    assert _pandas_rows(path) == (0, [])
+
+
+def test_read_line_from_file_matches_iter_csv_lines(csvfile):
+    with mycli.mmap_file(csvfile) as mapped_file:
+        line_index = mycli.build_line_index(mapped_file)
+        assert mycli.file_len(mapped_file) == len(line_index)
+        lines = [mycli.read_line_from_file(mapped_file, line_num, line_index)[0] for line_num in range(len(line_index))]
+    assert lines == [line for _, line in mycli.iter_csv_lines(csvfile)]
+
+
+def test_read_line_from_file_without_index_is_deprecated(csvfile):
+    with mycli.mmap_file(csvfile) as mapped_file:
+        with pytest.deprecated_call():
+            assert mycli.read_line_from_file(mapped_file, 0) == ('rowid,name,fuel', 0)
+        with pytest.deprecated_call():
+            assert mycli.read_line_from_file(mapped_file, 4) == ('4,Oconee,Hydro', 4)
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+@pytest.mark.parametrize("line_num", [-1, 5])
+def test_read_line_from_file_out_of_range(csvfile, line_num):
+    with mycli.mmap_file(csvfile) as mapped_file:
+        line_index = mycli.build_line_index(mapped_file)
+        with pytest.raises(IndexError):
+            mycli.read_line_from_file(mapped_file, line_num, line_index)
+        with pytest.raises(IndexError):
+            mycli.read_line_from_file(mapped_file, line_num)
+
+
+# click.testing.CliRunner runs the CLI in-process
+# https://click.palletsprojects.com/en/8.1.x/testing/
+def _invoke(*args):
+    return CliRunner().invoke(mycli.main, list(args))
+
+
+def test_logging_is_configured_once_per_process(monkeypatch, csvfile):
+    basic_configs = []
+    monkeypatch.setattr(mycli, "_LOGGING_CONFIGURED", False)
+    monkeypatch.setattr(mycli.logging, "basicConfig", lambda **kwargs: basic_configs.append(kwargs))
+    assert _invoke("csvstats", str(csvfile)).exit_code == 0
+    assert _invoke("--loglevel", "debug", "csvstats", str(csvfile)).exit_code == 0
+    assert len(basic_configs) == 1
+
+
+def test_csvstats_count(csvfile):
+    result = _invoke("-l", "notset", "csvstats", "--count", str(csvfile))
+    assert result.exit_code == 0
+    assert f"csvfile {csvfile} length is 5" in result.output
+    assert f"Number of data rows in {csvfile}: 4" in result.output
+
+
+def test_csvstats_pandas_without_pandas_is_a_usage_error(monkeypatch, csvfile):
+    monkeypatch.setattr(mycli, "_load_pandas", lambda: None)
+    result = _invoke("-l", "notset", "csvstats", "--all-rows", "--pandas", str(csvfile))
+    assert result.exit_code == 2
+    assert "pip install pandas" in result.output
+
+
+def test_csvstats_pandas_without_all_rows_is_a_usage_error(csvfile):
+    assert _invoke("-l", "notset", "csvstats", "--pandas", str(csvfile)).exit_code == 2
+
+
+def test_csvstats_only_sleeps_with_demo(monkeypatch, csvfile):
+    sleeps = []
+    monkeypatch.setattr(mycli.time, "sleep", sleeps.append)
+    assert _invoke("-l", "notset", "csvstats", str(csvfile)).exit_code == 0
+    assert sleeps == []
+    assert _invoke("-l", "notset", "csvstats", "--demo", str(csvfile)).exit_code == 0
+    assert sleeps == [3]
+
+
+@pytest.mark.parametrize("args", [[], ["--count"], ["--all-rows"], ["--count", "--all-rows"]])
+def test_csvstats_empty_file(tmp_path, args):
+    path = tmp_path / "empty.csv"
+    path.write_bytes(b'')
+    result = _invoke("-l", "notset", "csvstats", *args, str(path))
+    assert result.exit_code == 0
+    if "--count" in args:
+        assert f"csvfile {path} length is 0" in result.output
+
+
+@pytest.mark.parametrize("args", [[], ["--all-rows"]])
+def test_csvstats_non_utf8_file_is_an_error(tmp_path, args):
+    path = tmp_path / "latin1.csv"
+    path.write_bytes(b'a,b\n\xff,2\n')
+    result = _invoke("-l", "notset", "csvstats", *args, str(path))
+    assert result.exit_code == 1
+    assert "codec can't decode" in result.output